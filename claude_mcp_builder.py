@@ -1,46 +1,131 @@
 import os
+import re
+import ast
+import json
 import time
 import asyncio
-import base64
-from anthropic import Anthropic
-import open3d as o3d
-import numpy as np
+import hashlib
+import io
+import tempfile
+import threading
+import shutil
+import uuid
+import httpx
+from collections import OrderedDict
+from anthropic import AsyncAnthropic
+from PIL import Image
 from dotenv import load_dotenv
-from datetime import datetime, timedelta
-from collections import deque
+
+# Prefer pybase64's SIMD encoder for image payloads when it is installed
+try:
+    from pybase64 import b64encode
+except ImportError:
+    from base64 import b64encode
+
+# Prefer orjson for parsing responses; its JSONDecodeError subclasses json's
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
 
 load_dotenv()
 
+# Claude model used for generation
+_CLAUDE_MODEL = "claude-3-7-sonnet-20250219"
+
+# Prompt sent with every request; built once at import time
+_PROMPT_TEMPLATE = """
+        You are a CAD expert. Analyze these technical drawings and create a precise 3D model based on the provided orthographic views. Your task is to generate complete, executable OpenSCAD code.
+
+        1. DIMENSIONAL ANALYSIS:
+           - Extract all explicit dimensions from the drawings
+           - Calculate any implicit dimensions based on scale and relationships
+           - Define clear variable names for all dimensions
+           - Document units (assume mm if not specified)
+
+        2. FEATURE ANALYSIS:
+           - Identify the base shape and primary features
+           - Note all secondary features (holes, cuts, threads, etc.)
+           - Document feature relationships and positions
+           - Identify any patterns or symmetry
+
+        3. OPENSCAD IMPLEMENTATION:
+           - Start with clear variable definitions for ALL dimensions
+           - Create separate modules for complex features
+           - Use proper boolean operations (union, difference, intersection)
+           - ALWAYS include a final module call to render the object
+           - Use high resolution ($fn) for curved surfaces
+           - Add clear comments explaining each major step
+
+        After analysis, respond with ONLY a dictionary in this EXACT format:
+
+        {
+            "openscad_code": "// Your OpenSCAD code with proper newline escaping (\\n)",
+            "dimensions": {
+                "head_diameter": 10,
+                "head_height": 5,
+                "shaft_length": 20,
+                "shaft_diameter": 8,
+                "thread_pitch": 1.25,
+                "head_width": 12
+            }
+        }
+
+        CRITICAL REQUIREMENTS:
+        1. Use DOUBLE QUOTES for all strings
+        2. Escape newlines with \\n in OpenSCAD code
+        3. Include ONLY the dictionary in your response
+        4. Set $fn=64 or higher for curved surfaces
+        5. Use clear variable names prefixed with their category
+        6. Include comprehensive comments in the code
+        7. ALWAYS end the code with a module call to render the object
+        8. Ensure all dimensions are defined as variables at the start
+        9. Use proper scoping and modular design
+        10. All dimensions must be numeric values"""
+
+# Decoder for parsing JSON embedded in surrounding response text
+_JSON_DECODER = json.JSONDecoder()
+
+# Matches the OpenSCAD code string in a model response
+_OPENSCAD_CODE_RE = re.compile(r'"openscad_code":\s*"([^"]*)"')
+
+# Connection pool limits for the Anthropic client, so TLS connections are reused across requests
+_HTTP_LIMITS = httpx.Limits(max_keepalive_connections=20, max_connections=50, keepalive_expiry=60.0)
+
 class TokenBucket:
     def __init__(self, tokens_per_minute, window_size=60):
         self.capacity = tokens_per_minute
         self.window_size = window_size  # in seconds
-        self.tokens = deque()  # Store timestamps and token counts
+        self.rate = tokens_per_minute / window_size  # Refill rate in tokens per second
+        self.tokens = float(tokens_per_minute)  # Tokens currently available
+        self.last_refill = time.monotonic()
         
     async def consume(self, tokens):
-        now = datetime.now()
-        
-        # Remove old tokens outside the window
-        while self.tokens and (now - self.tokens[0][0]).total_seconds() > self.window_size:
-            self.tokens.popleft()
-        
-        # Calculate current token usage in window
-        current_usage = sum(count for _, count in self.tokens)
+        # A request larger than the bucket is admitted once the bucket is full
+        needed = min(tokens, self.capacity)
+        now = time.monotonic()
         
-        if current_usage + tokens > self.capacity:
-            # Calculate wait time needed
-            oldest_timestamp = self.tokens[0][0] if self.tokens else now
-            wait_seconds = self.window_size - (now - oldest_timestamp).total_seconds()
-            if wait_seconds > 0:
-                print(f"Rate limit reached. Waiting {wait_seconds:.2f} seconds...")
-                await asyncio.sleep(wait_seconds)
+        # Refill for the time elapsed since the last call
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
         
-        # Add new token usage
-        self.tokens.append((now, tokens))
+        # Reserve the tokens before sleeping, letting the balance go negative, so
+        # concurrent callers queue up behind each other and each sleeps only once
+        self.tokens -= needed
+        if self.tokens < 0:
+            wait_seconds = -self.tokens / self.rate
+            print(f"Rate limit reached. Waiting {wait_seconds:.2f} seconds...")
+            await asyncio.sleep(wait_seconds)
+    
+    def refund(self, tokens):
+        # Return tokens that were reserved but not actually used
+        self.tokens = min(self.capacity, self.tokens + tokens)
 
 class ClaudeMCPBuilder:
-    def __init__(self):
-        self.anthropic = Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
+    def __init__(self, debug: bool = False):
+        # Print raw model responses when enabled
+        self.debug = debug
         
         # Initialize token buckets for rate limiting
         self.input_token_bucket = TokenBucket(20000)  # 20k input tokens/minute
@@ -49,38 +134,168 @@ class ClaudeMCPBuilder:
         
         # Approximate token counts for different content types
         self.BASE_PROMPT_TOKENS = 100  # Base prompt template tokens
-        self.IMAGE_TOKENS = 1500  # Approximate tokens per image
+        self.IMAGE_TOKENS = 1500  # Fallback estimate when an image's size can't be read
+        self.MAX_IMAGE_TOKENS = 1600  # Claude downscales larger images to about this cost
+        
+        # (base64, token estimate) per image keyed by (path, mtime, size), least recently used first
+        self.IMAGE_CACHE_SIZE = 32  # Maximum number of cached images
+        self._image_cache = OrderedDict()
+        self._image_cache_lock = threading.Lock()  # _encode_image runs in worker threads
+        
+        # OpenSCAD executable, resolved on first use
+        self._openscad_path = None
         
         # Create output directories if they don't exist
-        os.makedirs("output", exist_ok=True)
+        self._output_dir = os.path.abspath("output")
+        os.makedirs(self._output_dir, exist_ok=True)
+        
+        # Directory of cached Claude responses, keyed by input hash
+        self.cache_dir = os.path.abspath("cache")
+        os.makedirs(self.cache_dir, exist_ok=True)
+        
+        # Async Anthropic client, created on first use so its connection pool
+        # belongs to the running event loop; released by aclose()
+        self._anthropic = None
+        
+    @property
+    def anthropic(self) -> AsyncAnthropic:
+        """Async Anthropic client reused by every request made through this builder"""
+        if self._anthropic is None:
+            self._anthropic = AsyncAnthropic(
+                api_key=os.getenv("ANTHROPIC_API_KEY"),
+                http_client=httpx.AsyncClient(limits=_HTTP_LIMITS)
+            )
+        return self._anthropic
+        
+    async def aclose(self):
+        """Close the Anthropic client and its pooled connections; call before the event loop ends"""
+        if self._anthropic is not None:
+            client, self._anthropic = self._anthropic, None
+            await client.close()
+        
+    async def __aenter__(self):
+        return self
         
-    def _encode_image(self, image_path: str) -> str:
-        """Encode image file to base64 string"""
-        with open(image_path, 'rb') as f:
-            image_bytes = f.read()
-            return base64.b64encode(image_bytes).decode('utf-8')
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
         
-    async def generate_model(self, side1_path: str, side2_path: str, side3_path: str, side4_path: str = None) -> tuple[str, str]:
+    def _encode_image(self, image_path: str) -> tuple[str, int]:
         """
-        Generate a 3D model from three or four side images using Claude 3.7 MCP
+        Encode image file to base64 string and estimate its input tokens,
+        reusing the result while the file is unchanged
         """
-        # Read and encode images
-        side1_b64 = self._encode_image(side1_path)
-        side2_b64 = self._encode_image(side2_path)
-        side3_b64 = self._encode_image(side3_path)
-        side4_b64 = self._encode_image(side4_path) if side4_path else None
+        st = os.stat(image_path)
+        cache_key = (os.path.abspath(image_path), st.st_mtime_ns, st.st_size)
+        with self._image_cache_lock:
+            cached = self._image_cache.get(cache_key)
+            if cached is not None:
+                self._image_cache.move_to_end(cache_key)
+                return cached
+        
+        # Read straight into a buffer of the known size, without intermediate copies
+        image_bytes = bytearray(st.st_size)
+        with open(image_path, 'rb', buffering=0) as f:
+            view = memoryview(image_bytes)
+            pos = 0
+            while pos < st.st_size:
+                n = f.readinto(view[pos:])
+                if not n:
+                    break
+                pos += n
+        
+        # Base64 output is pure ASCII, so the ASCII codec is enough
+        encoded = (b64encode(view[:pos]).decode('ascii'), self._estimate_image_tokens(view[:pos]))
+        
+        # Bound the cache by evicting the least recently used entry
+        with self._image_cache_lock:
+            self._image_cache[cache_key] = encoded
+            self._image_cache.move_to_end(cache_key)
+            while len(self._image_cache) > self.IMAGE_CACHE_SIZE:
+                self._image_cache.popitem(last=False)
+        return encoded
+        
+    async def generate_model(self, *side_paths: str) -> tuple[str, str]:
+        """
+        Generate a 3D model from three or more side images using Claude 3.7 MCP
+        """
+        # Skip unused optional views, e.g. a side4_path of None
+        side_paths = [path for path in side_paths if path]
+        if len(side_paths) < 3:
+            raise ValueError("At least three side images are required")
+
+        # Read, encode and size images concurrently, off the event loop
+        encoded = await asyncio.gather(
+            *(asyncio.to_thread(self._encode_image, path) for path in side_paths)
+        )
+        images_b64 = [image_b64 for image_b64, _ in encoded]
+
+        # Reuse a cached response for identical images, skipping the API call and rate limits
+        cache_path = os.path.join(self.cache_dir, f"{self._cache_key(*images_b64)}.json")
+        response_text = self._load_cached_response(cache_path)
+        cache_hit = response_text is not None
+        if not cache_hit:
+            image_tokens = sum(tokens for _, tokens in encoded)
+            response_text = await self._request_model(images_b64, image_tokens)
+
+        # Generate 3D model using OpenSCAD
+        stl_path, brep_path = await self._generate_3d_files(response_text)
+
+        # Cache the response only once it has produced a model
+        if not cache_hit:
+            self._save_cached_response(cache_path, response_text)
+
+        return stl_path, brep_path
+
+    def _estimate_image_tokens(self, image_bytes: memoryview) -> int:
+        """Estimate Claude's input tokens for an image as (width * height) / 750"""
+        try:
+            # Image.open parses only the header
+            with Image.open(io.BytesIO(image_bytes)) as img:
+                width, height = img.size
+        except OSError:
+            return self.IMAGE_TOKENS
+        return min(width * height // 750, self.MAX_IMAGE_TOKENS)
+
+    def _cache_key(self, *images_b64: str) -> str:
+        """Hash the model, prompt and encoded images into a cache key"""
+        digest = hashlib.sha256()
+        digest.update(_CLAUDE_MODEL.encode('ascii'))
+        digest.update(_PROMPT_TEMPLATE.encode('utf-8'))
+        for image_b64 in images_b64:
+            # NUL is outside the base64 alphabet, so image boundaries stay unambiguous
+            digest.update(b'\0')
+            digest.update(image_b64.encode('ascii'))
+        return digest.hexdigest()
+
+    def _load_cached_response(self, cache_path: str):
+        """Return the cached response text, or None on a cache miss"""
+        try:
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                return json.load(f)['response_text']
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _save_cached_response(self, cache_path: str, response_text: str):
+        """Store the response text for later runs on the same images"""
+        try:
+            with open(cache_path, 'w', encoding='utf-8') as f:
+                json.dump({'response_text': response_text}, f)
+        except OSError as e:
+            print(f"Could not write response cache: {str(e)}")
 
+    async def _request_model(self, images_b64: list[str], image_tokens: int) -> str:
+        """Send the encoded images to Claude and return the response text"""
         # Create prompt for Claude
         prompt = self._create_prompt()
         
-        # Calculate approximate input tokens
-        total_input_tokens = self.BASE_PROMPT_TOKENS + (self.IMAGE_TOKENS * (4 if side4_path else 3))
+        # Calculate approximate input tokens to reserve before the call
+        total_input_tokens = self.BASE_PROMPT_TOKENS + image_tokens
         
-        # Wait if needed based on input token rate limit
-        await self.input_token_bucket.consume(total_input_tokens)
-        
-        # Wait if needed based on request rate limit
-        await self.request_bucket.consume(1)
+        # Wait if needed based on input token and request rate limits; the waits overlap
+        await asyncio.gather(
+            self.input_token_bucket.consume(total_input_tokens),
+            self.request_bucket.consume(1)
+        )
 
         PROMPT = "Here are multiple side view images of an object. Please analyze them carefully to understand all features and dimensions."
         
@@ -89,41 +304,17 @@ class ClaudeMCPBuilder:
             {
                 "type": "text",
                 "text": PROMPT
-            },
-            {
-                "type": "image",
-                "source": {
-                    "type": "base64",
-                    "media_type": "image/jpeg",
-                    "data": side1_b64
-                }
-            },
-            {
-                "type": "image",
-                "source": {
-                    "type": "base64",
-                    "media_type": "image/jpeg",
-                    "data": side2_b64
-                }
-            },
-            {
-                "type": "image",
-                "source": {
-                    "type": "base64",
-                    "media_type": "image/jpeg",
-                    "data": side3_b64
-                }
             }
         ]
 
-        # Add fourth image if provided
-        if side4_b64:
+        # Add one image block per side view
+        for image_b64 in images_b64:
             message_content.append({
                 "type": "image",
                 "source": {
                     "type": "base64",
                     "media_type": "image/jpeg",
-                    "data": side4_b64
+                    "data": image_b64
                 }
             })
 
@@ -134,8 +325,8 @@ class ClaudeMCPBuilder:
         })
 
         # Get Claude's response
-        response = self.anthropic.messages.create(
-            model="claude-3-7-sonnet-20250219",
+        response = await self.anthropic.messages.create(
+            model=_CLAUDE_MODEL,
             max_tokens=1000,
             messages=[{
                 "role": "user",
@@ -144,77 +335,31 @@ class ClaudeMCPBuilder:
         )
         
         # Debug: Print response type and content
-        print(f"Response type: {type(response.content)}")
-        print(f"Response content: {response.content}")
+        if self.debug:
+            print(f"Response type: {type(response.content)}")
+            print(f"Response content: {response.content}")
         
         # Extract the text content from response
-        if isinstance(response.content, list):
-            response_text = response.content[0].text if hasattr(response.content[0], 'text') else str(response.content[0])
-        else:
-            response_text = response.content.text if hasattr(response.content, 'text') else str(response.content)
+        block = response.content[0] if isinstance(response.content, list) else response.content
+        response_text = getattr(block, 'text', None) or str(block)
         
         # Debug: Print processed response
-        print(f"Processed response: {response_text}")
+        if self.debug:
+            print(f"Processed response: {response_text}")
         
-        # Approximate output tokens
-        output_tokens = len(response_text) * 2
-        await self.output_token_bucket.consume(int(output_tokens))
-
-        # Generate 3D model using OpenSCAD
-        stl_path, brep_path = self._generate_3d_files(response_text)
+        # True up the input reservation and charge output tokens from the reported usage
+        input_delta = response.usage.input_tokens - total_input_tokens
+        if input_delta > 0:
+            await self.input_token_bucket.consume(input_delta)
+        elif input_delta < 0:
+            self.input_token_bucket.refund(-input_delta)
+        await self.output_token_bucket.consume(response.usage.output_tokens)
 
-        return stl_path, brep_path
+        return response_text
 
     def _create_prompt(self) -> str:
         """Create prompt for Claude based on the images"""
-        return """
-        You are a CAD expert. Analyze these technical drawings and create a precise 3D model based on the provided orthographic views. Your task is to generate complete, executable OpenSCAD code.
-
-        1. DIMENSIONAL ANALYSIS:
-           - Extract all explicit dimensions from the drawings
-           - Calculate any implicit dimensions based on scale and relationships
-           - Define clear variable names for all dimensions
-           - Document units (assume mm if not specified)
-
-        2. FEATURE ANALYSIS:
-           - Identify the base shape and primary features
-           - Note all secondary features (holes, cuts, threads, etc.)
-           - Document feature relationships and positions
-           - Identify any patterns or symmetry
-
-        3. OPENSCAD IMPLEMENTATION:
-           - Start with clear variable definitions for ALL dimensions
-           - Create separate modules for complex features
-           - Use proper boolean operations (union, difference, intersection)
-           - ALWAYS include a final module call to render the object
-           - Use high resolution ($fn) for curved surfaces
-           - Add clear comments explaining each major step
-
-        After analysis, respond with ONLY a dictionary in this EXACT format:
-
-        {
-            "openscad_code": "// Your OpenSCAD code with proper newline escaping (\\n)",
-            "dimensions": {
-                "head_diameter": 10,
-                "head_height": 5,
-                "shaft_length": 20,
-                "shaft_diameter": 8,
-                "thread_pitch": 1.25,
-                "head_width": 12
-            }
-        }
-
-        CRITICAL REQUIREMENTS:
-        1. Use DOUBLE QUOTES for all strings
-        2. Escape newlines with \\n in OpenSCAD code
-        3. Include ONLY the dictionary in your response
-        4. Set $fn=64 or higher for curved surfaces
-        5. Use clear variable names prefixed with their category
-        6. Include comprehensive comments in the code
-        7. ALWAYS end the code with a module call to render the object
-        8. Ensure all dimensions are defined as variables at the start
-        9. Use proper scoping and modular design
-        10. All dimensions must be numeric values"""
+        return _PROMPT_TEMPLATE
 
     def _extract_dict_from_response(self, response_text: str) -> dict:
         """Extract the dictionary from Claude's response"""
@@ -224,31 +369,38 @@ class ClaudeMCPBuilder:
             if dict_start == -1:
                 raise ValueError("No dictionary found in response")
 
-            # Find the dictionary end
-            dict_end = response_text.rfind('}')
-            if dict_end == -1:
-                raise ValueError("No closing brace found")
-
-            # Extract the dictionary string
-            dict_str = response_text[dict_start:dict_end + 1]
-            dict_str = dict_str.strip()
-            dict_str = dict_str.replace("'", '"')
-
-            # Clean up newlines in OpenSCAD code
-            import json
             try:
-                result = json.loads(dict_str)
+                # Valid JSON parses in a single pass that also finds the dictionary end
+                result, _ = _JSON_DECODER.raw_decode(response_text, dict_start)
             except json.JSONDecodeError:
-                # If failed, try to clean up the OpenSCAD code
-                import re
-                code_match = re.search(r'"openscad_code":\s*"([^"]*)"', dict_str)
-                if code_match:
-                    code = code_match.group(1)
-                    code = code.replace('\n', '\\n')
-                    dict_str = re.sub(r'"openscad_code":\s*"[^"]*"', f'"openscad_code": "{code}"', dict_str)
-                    result = json.loads(dict_str)
-                else:
-                    raise ValueError("Could not find OpenSCAD code in response")
+                # Find the dictionary end
+                dict_end = response_text.rfind('}')
+                if dict_end == -1:
+                    raise ValueError("No closing brace found")
+
+                # Extract the dictionary string
+                dict_str = response_text[dict_start:dict_end + 1]
+                dict_str = dict_str.strip()
+
+                try:
+                    # Python-style dict literals parse as-is, keeping apostrophes inside strings intact
+                    result = ast.literal_eval(dict_str)
+                except (ValueError, SyntaxError):
+                    dict_str = dict_str.replace("'", '"')
+
+                    # Clean up newlines in OpenSCAD code
+                    try:
+                        result = _json_loads(dict_str)
+                    except json.JSONDecodeError:
+                        # If failed, try to clean up the OpenSCAD code
+                        code_match = _OPENSCAD_CODE_RE.search(dict_str)
+                        if code_match:
+                            code = code_match.group(1)
+                            code = code.replace('\n', '\\n')
+                            dict_str = _OPENSCAD_CODE_RE.sub(lambda _: f'"openscad_code": "{code}"', dict_str)
+                            result = _json_loads(dict_str)
+                        else:
+                            raise ValueError("Could not find OpenSCAD code in response")
 
             # Validate the structure
             if not isinstance(result, dict):
@@ -283,6 +435,10 @@ class ClaudeMCPBuilder:
 
     def _find_openscad_path(self) -> str:
         """Find the OpenSCAD executable path"""
+        # Reuse the path found by an earlier call
+        if self._openscad_path:
+            return self._openscad_path
+        
         # Common installation paths for OpenSCAD on Windows
         possible_paths = [
             r"C:\Program Files\OpenSCAD\openscad.exe",
@@ -293,24 +449,34 @@ class ClaudeMCPBuilder:
         # Check common installation paths first
         for path in possible_paths:
             if os.path.exists(path):
+                self._openscad_path = path
                 return path
                 
-        # Check if OpenSCAD is in PATH
-        import subprocess
-        try:
-            result = subprocess.run(['where', 'openscad'], capture_output=True, text=True)
-            if result.returncode == 0:
-                # Take the first path found
-                return result.stdout.strip().split('\n')[0]
-        except Exception:
-            pass
+        # Check if OpenSCAD is in PATH (shutil.which also applies PATHEXT on Windows)
+        path = shutil.which('openscad')
+        if path:
+            self._openscad_path = path
+            return path
             
         raise ValueError(
             "OpenSCAD not found. Please install it from https://openscad.org/downloads.html "
             "and make sure it's in your system PATH or installed in the default location."
         )
 
-    def _generate_3d_files(self, claude_response: str) -> tuple[str, str]:
+    @staticmethod
+    def _write_file(path: str, content: str):
+        """Write text content to a file atomically via a unique sibling temp file"""
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            # Binary mode skips newline translation; the content already uses '\n'
+            with os.fdopen(fd, 'wb') as f:
+                f.write(content.encode('utf-8'))
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    async def _generate_3d_files(self, claude_response: str) -> tuple[str, str]:
         """Generate STL and BREP files using OpenSCAD"""
         try:
             # Extract the dictionary containing OpenSCAD code and dimensions
@@ -319,48 +485,57 @@ class ClaudeMCPBuilder:
             # Get the OpenSCAD code and ensure it ends with a newline
             openscad_code = model_dict['openscad_code'].replace('\\n', '\n').strip() + '\n'
             
-            # Create output directory if it doesn't exist
-            output_dir = os.path.abspath(os.path.join("output"))
-            os.makedirs(output_dir, exist_ok=True)
+            # Unique file names so concurrent requests don't overwrite each other
+            file_id = uuid.uuid4().hex
+            scad_path = os.path.join(self._output_dir, f"model_{file_id}.scad")
+            stl_path = os.path.join(self._output_dir, f"output_{file_id}.stl")
+            brep_path = os.path.join(self._output_dir, f"output_{file_id}.brep")
+            # OpenSCAD renders here first so the STL only appears once complete
+            tmp_stl_path = os.path.join(self._output_dir, f"output_{file_id}.tmp.stl")
             
-            # Create paths using proper Windows path handling
-            scad_path = os.path.join(output_dir, "model.scad")
-            stl_path = os.path.join(output_dir, "output.stl")
-            brep_path = os.path.join(output_dir, "output.brep")
+            # Find OpenSCAD executable before writing anything it would consume
+            openscad_exe = self._find_openscad_path()
             
             # Write OpenSCAD file
-            with open(scad_path, 'w') as f:
-                f.write(openscad_code)
+            await asyncio.to_thread(self._write_file, scad_path, openscad_code)
             
             print(f"Generated OpenSCAD file at: {scad_path}")
             print(f"OpenSCAD code:\n{openscad_code}")
             
-            # Find OpenSCAD executable
-            openscad_exe = self._find_openscad_path()
-            
-            # Run OpenSCAD using subprocess for better path handling
-            import subprocess
+            # Run OpenSCAD as an async subprocess so the event loop keeps running
             try:
-                result = subprocess.run([
+                proc = await asyncio.create_subprocess_exec(
                     openscad_exe,
+                    "--export-format",
+                    "binstl",  # Binary STL is much smaller and faster to write than ASCII
                     "-o",
-                    stl_path,
-                    scad_path
-                ], capture_output=True, text=True)
+                    tmp_stl_path,
+                    scad_path,
+                    stdout=asyncio.subprocess.DEVNULL,  # stdout is never used
+                    stderr=asyncio.subprocess.PIPE
+                )
+                _, stderr = await proc.communicate()
                 
-                if result.returncode != 0:
+                if proc.returncode != 0:
                     print("OpenSCAD Error Output:")
-                    print(result.stderr)
-                    raise ValueError(f"OpenSCAD command failed with exit code {result.returncode}")
+                    print(stderr.decode('utf-8', errors='replace'))
+                    raise ValueError(f"OpenSCAD command failed with exit code {proc.returncode}")
+                
+                os.replace(tmp_stl_path, stl_path)
                 
             except Exception as e:
                 print(f"Error running OpenSCAD: {str(e)}")
-                print(f"Command attempted: {openscad_exe} -o {stl_path} {scad_path}")
+                print(f"Command attempted: {openscad_exe} --export-format binstl -o {tmp_stl_path} {scad_path}")
+                # Drop any partial render
+                if os.path.exists(tmp_stl_path):
+                    os.remove(tmp_stl_path)
                 raise ValueError("Failed to run OpenSCAD command. Please ensure OpenSCAD is properly installed.")
+            finally:
+                # The .scad file is only an input to the render
+                os.remove(scad_path)
             
             # Save dimensions as BREP
-            with open(brep_path, 'w') as f:
-                f.write(str(model_dict['dimensions']))
+            await asyncio.to_thread(self._write_file, brep_path, str(model_dict['dimensions']))
             
             return stl_path, brep_path
             
@@ -1,155 +1,39 @@
 import os
-import time
+import re
+import json
 import asyncio
-import base64
+import hashlib
+import tempfile
+import uuid
+import shutil
+from typing import Union
 import google.generativeai as genai
 from PIL import Image
-import numpy as np
 from dotenv import load_dotenv
-from datetime import datetime, timedelta
-from collections import deque
 
-load_dotenv()
+# Prefer orjson for parsing and writing JSON; its JSONDecodeError subclasses json's
+try:
+    import orjson
+    _json_loads = orjson.loads
 
-class TokenBucket:
-    def __init__(self, tokens_per_minute, window_size=60):
-        self.capacity = tokens_per_minute
-        self.window_size = window_size  # in seconds
-        self.tokens = deque()  # Store timestamps and token counts
-        
-    async def consume(self, tokens):
-        now = datetime.now()
-        
-        # Remove old tokens outside the window
-        while self.tokens and (now - self.tokens[0][0]).total_seconds() > self.window_size:
-            self.tokens.popleft()
-        
-        # Calculate current token usage in window
-        current_usage = sum(count for _, count in self.tokens)
-        
-        if current_usage + tokens > self.capacity:
-            # Calculate wait time needed
-            oldest_timestamp = self.tokens[0][0] if self.tokens else now
-            wait_seconds = self.window_size - (now - oldest_timestamp).total_seconds()
-            if wait_seconds > 0:
-                print(f"Rate limit reached. Waiting {wait_seconds:.2f} seconds...")
-                await asyncio.sleep(wait_seconds)
-        
-        # Add new token usage
-        self.tokens.append((now, tokens))
+    def _json_dumps(obj) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+except ImportError:
+    _json_loads = json.loads
 
-class GeminiBuilder:
-    def __init__(self):
-        # Configure the Gemini API
-        genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
-        
-        # Initialize Gemini gemini-2.0-flash
-        generation_config = {
-            "temperature": 0.1,  # Lower temperature for more precise outputs
-            "top_p": 0.5,       # More focused sampling
-            "top_k": 32,        # Limit vocabulary diversity
-            "max_output_tokens": 2048,  # Allow for longer responses
-        }
-        
-        safety_settings = [
-            {
-                "category": "HARM_CATEGORY_HARASSMENT",
-                "threshold": "BLOCK_NONE",
-            },
-            {
-                "category": "HARM_CATEGORY_HATE_SPEECH",
-                "threshold": "BLOCK_NONE",
-            },
-            {
-                "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
-                "threshold": "BLOCK_NONE",
-            },
-            {
-                "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
-                "threshold": "BLOCK_NONE",
-            },
-        ]
-        
-        self.model = genai.GenerativeModel(
-            model_name="gemini-2.0-flash",
-            generation_config=generation_config,
-            safety_settings=safety_settings
-        )
-        
-        # Initialize token buckets for rate limiting
-        self.request_bucket = TokenBucket(60)  # 60 requests/minute
-        
-        # Create output directories if they don't exist
-        os.makedirs("output", exist_ok=True)
-        
-    def _load_image(self, image_path: str) -> Image.Image:
-        """Load and prepare image for Gemini"""
-        try:
-            img = Image.open(image_path)
-            # Convert to RGB if needed
-            if img.mode != 'RGB':
-                img = img.convert('RGB')
-            # Resize if too large (Gemini has a 4MB limit per image)
-            max_size = 1024
-            if max(img.size) > max_size:
-                ratio = max_size / max(img.size)
-                new_size = tuple(int(dim * ratio) for dim in img.size)
-                img = img.resize(new_size, Image.Resampling.LANCZOS)
-            return img
-        except Exception as e:
-            raise ValueError(f"Error loading image {image_path}: {str(e)}")
-        
-    async def generate_model(self, side1_path: str, side2_path: str, side3_path: str, side4_path: str = None) -> tuple[str, str]:
-        """
-        Generate a 3D model from three or four side images using Gemini Pro Vision
-        """
-        try:
-            # Load images
-            side1_img = self._load_image(side1_path)
-            side2_img = self._load_image(side2_path)
-            side3_img = self._load_image(side3_path)
-            side4_img = self._load_image(side4_path) if side4_path else None
-
-            # Create prompt for Gemini
-            prompt = self._create_prompt()
-            
-            # Wait if needed based on request rate limit
-            await self.request_bucket.consume(1)
-
-            # Prepare content list
-            contents = [prompt, side1_img, side2_img, side3_img]
-            if side4_img:
-                contents.append(side4_img)
-
-            # Get Gemini's response
-            response = self.model.generate_content(
-                contents=contents,
-                stream=False
-            )
-            
-            # Check if response was blocked
-            if response.prompt_feedback.block_reason:
-                raise ValueError(f"Response blocked: {response.prompt_feedback.block_reason}")
-            
-            # Debug: Print response
-            print(f"Response type: {type(response.text)}")
-            print(f"Response content: {response.text}")
-            
-            # Extract the dictionary containing OpenSCAD code and dimensions
-            result = self._extract_dict_from_response(response.text)
-            
-            # Generate 3D model using OpenSCAD
-            stl_path, brep_path = self._generate_3d_files(result)
+    def _json_dumps(obj) -> bytes:
+        return json.dumps(obj, indent=2, ensure_ascii=False).encode('utf-8')
 
-            return stl_path, brep_path
-            
-        except Exception as e:
-            print(f"Error in generate_model: {str(e)}")
-            raise e
+load_dotenv()
 
-    def _create_prompt(self) -> str:
-        """Create prompt for Gemini based on the images"""
-        return """
+# Matches the OpenSCAD code string in a model response
+_SCAD_RE = re.compile(r'"openscad_code":\s*"([^"]*)"')
+
+# Gemini model used for generation
+_GEMINI_MODEL = "gemini-2.0-flash"
+
+# Prompt sent with every request; built once at import time
+_PROMPT_TEMPLATE = """
         You are a CAD expert. Analyze these technical drawings and create a precise 3D model based on the provided views. Generate complete, executable OpenSCAD code.
 
         1. DIMENSIONAL ANALYSIS:
@@ -240,6 +124,234 @@ class GeminiBuilder:
         11. Cross-reference features across ALL views
         12. Verify geometric continuity"""
 
+class TokenBucket:
+    """Leaky-bucket rate limiter allowing tokens_per_minute per window_size seconds"""
+    __slots__ = ("max_rate", "time_period", "_rate_per_sec", "_level", "_last_check")
+    
+    def __init__(self, tokens_per_minute, window_size=60):
+        self.max_rate = tokens_per_minute
+        self.time_period = window_size  # in seconds
+        self._rate_per_sec = tokens_per_minute / window_size
+        self._level = 0.0  # Tokens currently in the bucket, leaking at _rate_per_sec
+        self._last_check = None
+        
+    async def consume(self, tokens):
+        now = asyncio.get_running_loop().time()
+        
+        # Leak the bucket for the time elapsed since the last call
+        if self._last_check is not None:
+            self._level = max(0.0, self._level - (now - self._last_check) * self._rate_per_sec)
+        self._last_check = now
+        
+        # Reserve the tokens before sleeping so concurrent callers queue up behind them
+        overflow = self._level + tokens - self.max_rate
+        self._level += tokens
+        if overflow > 0:
+            wait_seconds = overflow / self._rate_per_sec
+            print(f"Rate limit reached. Waiting {wait_seconds:.2f} seconds...")
+            await asyncio.sleep(wait_seconds)
+
+class GeminiBuilder:
+    def __init__(self):
+        # Configure the Gemini API
+        genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+        
+        # Initialize Gemini gemini-2.0-flash
+        generation_config = {
+            "temperature": 0.1,  # Lower temperature for more precise outputs
+            "top_p": 0.5,       # More focused sampling
+            "top_k": 32,        # Limit vocabulary diversity
+            "max_output_tokens": 2048,  # Allow for longer responses
+        }
+        
+        safety_settings = [
+            {
+                "category": "HARM_CATEGORY_HARASSMENT",
+                "threshold": "BLOCK_NONE",
+            },
+            {
+                "category": "HARM_CATEGORY_HATE_SPEECH",
+                "threshold": "BLOCK_NONE",
+            },
+            {
+                "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
+                "threshold": "BLOCK_NONE",
+            },
+            {
+                "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
+                "threshold": "BLOCK_NONE",
+            },
+        ]
+        
+        self.model = genai.GenerativeModel(
+            model_name=_GEMINI_MODEL,
+            generation_config=generation_config,
+            safety_settings=safety_settings
+        )
+        
+        # Initialize token buckets for rate limiting
+        self.request_bucket = TokenBucket(60)  # 60 requests/minute
+        
+        # Images below this size are sent without re-encoding (Gemini allows 4MB per image)
+        self.MAX_RAW_IMAGE_BYTES = 3_500_000
+        # Longest side, in pixels, of images sent to Gemini
+        self.MAX_IMAGE_SIZE = 1024
+        
+        # OpenSCAD executable, resolved on first use
+        self._openscad_path = None
+        
+        # Limit on OpenSCAD processes running at once, created on first use so it
+        # binds to the running event loop
+        self._scad_sem = None
+        
+        # Create output directories if they don't exist
+        self._output_dir = os.path.abspath("output")
+        os.makedirs(self._output_dir, exist_ok=True)
+        
+        # Directory of cached Gemini responses, keyed by input hash
+        self.cache_dir = os.path.abspath("cache")
+        os.makedirs(self.cache_dir, exist_ok=True)
+        
+    def _load_image(self, image_path: str) -> Union[Image.Image, dict]:
+        """Load and prepare image for Gemini"""
+        try:
+            # Image.open reads only the header; pixels are decoded on first access
+            img = Image.open(image_path)
+            # Resize if too large (Gemini has a 4MB limit per image)
+            max_size = self.MAX_IMAGE_SIZE
+            
+            # Small JPEG/PNG files already within the size cap are sent as raw bytes,
+            # skipping the decode and resize
+            if (img.format in ('JPEG', 'PNG') and max(img.size) <= max_size
+                    and os.path.getsize(image_path) < self.MAX_RAW_IMAGE_BYTES):
+                img.close()
+                with open(image_path, 'rb') as f:
+                    return {"mime_type": Image.MIME[img.format], "data": f.read()}
+            
+            # Let libjpeg downscale during decode; a no-op for non-JPEG images
+            img.draft('RGB', (max_size, max_size))
+            # Convert to RGB if needed
+            if img.mode != 'RGB':
+                img = img.convert('RGB')
+            # Downscale in place, preserving aspect ratio; a no-op when already small enough
+            img.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+            return img
+        except Exception as e:
+            raise ValueError(f"Error loading image {image_path}: {str(e)}")
+        
+    async def generate_model(self, side1_path: str, side2_path: str, side3_path: str, side4_path: str = None) -> tuple[str, str]:
+        """
+        Generate a 3D model from three or four side images using Gemini Pro Vision
+        """
+        try:
+            # Reuse a cached response for identical images, skipping image loading and the API call
+            side_paths = [path for path in (side1_path, side2_path, side3_path, side4_path) if path]
+            cache_key = await asyncio.to_thread(self._cache_key, side_paths)
+            cache_path = os.path.join(self.cache_dir, f"{cache_key}.json")
+            response_text = self._load_cached_response(cache_path)
+            cache_hit = response_text is not None
+            if not cache_hit:
+                response_text = await self._request_model(side1_path, side2_path, side3_path, side4_path)
+            
+            # Extract the dictionary containing OpenSCAD code and dimensions
+            result = self._extract_dict_from_response(response_text)
+            
+            # Generate 3D model using OpenSCAD
+            stl_path, brep_path = await self._generate_3d_files(result)
+
+            # Cache the response only once it has produced a model
+            if not cache_hit:
+                self._save_cached_response(cache_path, response_text)
+
+            return stl_path, brep_path
+            
+        except Exception as e:
+            print(f"Error in generate_model: {str(e)}")
+            raise e
+
+    async def _request_model(self, side1_path: str, side2_path: str, side3_path: str, side4_path: str = None) -> str:
+        """Send the side images to Gemini and return the response text"""
+        # Load images concurrently in worker threads, off the event loop
+        side1_img, side2_img, side3_img, side4_img = await asyncio.gather(
+            asyncio.to_thread(self._load_image, side1_path),
+            asyncio.to_thread(self._load_image, side2_path),
+            asyncio.to_thread(self._load_image, side3_path),
+            asyncio.to_thread(self._load_image, side4_path) if side4_path else asyncio.sleep(0, result=None)
+        )
+
+        # Create prompt for Gemini
+        prompt = self._create_prompt()
+        
+        # Wait if needed based on request rate limit
+        await self.request_bucket.consume(1)
+
+        # Prepare content list
+        contents = [prompt, side1_img, side2_img, side3_img]
+        if side4_img:
+            contents.append(side4_img)
+
+        # Get Gemini's response without blocking the event loop
+        response = await self.model.generate_content_async(
+            contents=contents,
+            stream=False
+        )
+        
+        # Check if response was blocked
+        if response.prompt_feedback.block_reason:
+            raise ValueError(f"Response blocked: {response.prompt_feedback.block_reason}")
+        
+        # Debug: Print response
+        print(f"Response type: {type(response.text)}")
+        print(f"Response content: {response.text}")
+        
+        return response.text
+
+    def _cache_key(self, side_paths: list[str]) -> str:
+        """Hash the model, prompt and image file contents into a cache key"""
+        digest = hashlib.sha256()
+        digest.update(_GEMINI_MODEL.encode('ascii'))
+        digest.update(_PROMPT_TEMPLATE.encode('utf-8'))
+        for path in side_paths:
+            # Prefix each image with its size so boundaries between files stay unambiguous
+            digest.update(f"{os.path.getsize(path)}\0".encode('ascii'))
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 16), b''):
+                    digest.update(chunk)
+        return digest.hexdigest()
+
+    def _load_cached_response(self, cache_path: str):
+        """Return the cached response text, or None on a cache miss"""
+        try:
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                return json.load(f)['response_text']
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _save_cached_response(self, cache_path: str, response_text: str):
+        """Store the response text for later runs on the same images"""
+        try:
+            with open(cache_path, 'w', encoding='utf-8') as f:
+                json.dump({'response_text': response_text}, f)
+        except OSError as e:
+            print(f"Could not write response cache: {str(e)}")
+
+    async def generate_many(self, jobs: list[tuple], concurrency_limit: int = 8) -> list[tuple[str, str]]:
+        """
+        Generate several 3D models concurrently, one per tuple of side image paths,
+        with at most concurrency_limit generations in flight at once
+        """
+        semaphore = asyncio.Semaphore(concurrency_limit)
+
+        async def run(job):
+            async with semaphore:
+                return await self.generate_model(*job)
+
+        return await asyncio.gather(*(run(job) for job in jobs))
+
+    def _create_prompt(self) -> str:
+        """Create prompt for Gemini based on the images"""
+        return _PROMPT_TEMPLATE
+
     def _extract_dict_from_response(self, response_text: str) -> dict:
         """Extract the dictionary from Gemini's response"""
         try:
@@ -256,23 +368,26 @@ class GeminiBuilder:
             # Extract the dictionary string
             dict_str = response_text[dict_start:dict_end + 1]
             dict_str = dict_str.strip()
-            dict_str = dict_str.replace("'", '"')
 
-            # Clean up newlines in OpenSCAD code
-            import json
             try:
-                result = json.loads(dict_str)
+                # Parse the raw text first; swapping quotes would corrupt apostrophes in strings
+                result = _json_loads(dict_str)
             except json.JSONDecodeError:
-                # If failed, try to clean up the OpenSCAD code
-                import re
-                code_match = re.search(r'"openscad_code":\s*"([^"]*)"', dict_str)
-                if code_match:
-                    code = code_match.group(1)
-                    code = code.replace('\n', '\\n')
-                    dict_str = re.sub(r'"openscad_code":\s*"[^"]*"', f'"openscad_code": "{code}"', dict_str)
-                    result = json.loads(dict_str)
-                else:
-                    raise ValueError("Could not find OpenSCAD code in response")
+                dict_str = dict_str.replace("'", '"')
+
+                # Clean up newlines in OpenSCAD code
+                try:
+                    result = _json_loads(dict_str)
+                except json.JSONDecodeError:
+                    # If failed, try to clean up the OpenSCAD code
+                    code_match = _SCAD_RE.search(dict_str)
+                    if code_match:
+                        code = code_match.group(1)
+                        code = code.replace('\n', '\\n')
+                        dict_str = _SCAD_RE.sub(lambda _: f'"openscad_code": "{code}"', dict_str)
+                        result = _json_loads(dict_str)
+                    else:
+                        raise ValueError("Could not find OpenSCAD code in response")
 
             # Validate the structure
             if not isinstance(result, dict):
@@ -286,10 +401,10 @@ class GeminiBuilder:
             if not isinstance(dims, dict) or not dims:
                 raise ValueError("Dimensions must be a non-empty dictionary")
 
-            # Ensure all dimension values are numeric
-            for key, value in dims.items():
-                if not isinstance(value, (int, float)):
-                    raise ValueError(f"Dimension '{key}' must have a numeric value")
+            # Ensure all dimension values are numeric (bools are rejected too)
+            bad = [key for key, value in dims.items() if type(value) not in (int, float)]
+            if bad:
+                raise ValueError(f"Dimensions must have numeric values: {', '.join(bad)}")
 
             return result
 
@@ -301,6 +416,10 @@ class GeminiBuilder:
 
     def _find_openscad_path(self) -> str:
         """Find the OpenSCAD executable path"""
+        # Reuse the path found by an earlier call
+        if self._openscad_path:
+            return self._openscad_path
+        
         # Common installation paths for OpenSCAD on Windows
         possible_paths = [
             r"C:\Program Files\OpenSCAD\openscad.exe",
@@ -311,71 +430,92 @@ class GeminiBuilder:
         # Check common installation paths first
         for path in possible_paths:
             if os.path.exists(path):
+                self._openscad_path = path
                 return path
                 
-        # Check if OpenSCAD is in PATH
-        import subprocess
-        try:
-            result = subprocess.run(['where', 'openscad'], capture_output=True, text=True)
-            if result.returncode == 0:
-                # Take the first path found
-                return result.stdout.strip().split('\n')[0]
-        except Exception:
-            pass
+        # Check if OpenSCAD is in PATH (shutil.which also applies PATHEXT on Windows)
+        path = shutil.which('openscad')
+        if path:
+            self._openscad_path = path
+            return path
             
         raise ValueError(
             "OpenSCAD not found. Please install it from https://openscad.org/downloads.html "
             "and make sure it's in your system PATH or installed in the default location."
         )
 
-    def _generate_3d_files(self, model_dict: dict) -> tuple[str, str]:
+    @staticmethod
+    def _write_file(path: str, data: bytes):
+        """Write bytes to a file atomically via a unique sibling temp file"""
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    async def _generate_3d_files(self, model_dict: dict) -> tuple[str, str]:
         """Generate STL and BREP files using OpenSCAD"""
         try:
             # Get the OpenSCAD code and ensure it ends with a newline
             openscad_code = model_dict['openscad_code'].replace('\\n', '\n').strip() + '\n'
             
-            # Create output directory if it doesn't exist
-            output_dir = os.path.abspath(os.path.join("output"))
-            os.makedirs(output_dir, exist_ok=True)
+            # Create per-request paths so concurrent generations don't overwrite each other
+            req_id = uuid.uuid4().hex
+            scad_path = os.path.join(self._output_dir, f"model_{req_id}.scad")
+            stl_path = os.path.join(self._output_dir, f"output_{req_id}.stl")
+            brep_path = os.path.join(self._output_dir, f"output_{req_id}.brep")
+            # OpenSCAD renders here first so the STL only appears once complete
+            tmp_stl_path = os.path.join(self._output_dir, f"output_{req_id}.tmp.stl")
             
-            # Create paths using proper Windows path handling
-            scad_path = os.path.join(output_dir, "model.scad")
-            stl_path = os.path.join(output_dir, "output.stl")
-            brep_path = os.path.join(output_dir, "output.brep")
+            # Find OpenSCAD executable before writing anything it would consume
+            openscad_exe = self._find_openscad_path()
             
             # Write OpenSCAD file
-            with open(scad_path, 'w') as f:
-                f.write(openscad_code)
+            await asyncio.to_thread(self._write_file, scad_path, openscad_code.encode('utf-8'))
             
             print(f"Generated OpenSCAD file at: {scad_path}")
             print(f"OpenSCAD code:\n{openscad_code}")
             
-            # Find OpenSCAD executable
-            openscad_exe = self._find_openscad_path()
+            # Cap concurrent renders; each OpenSCAD process can use a full core
+            if self._scad_sem is None:
+                self._scad_sem = asyncio.Semaphore(os.cpu_count() or 4)
             
-            # Run OpenSCAD using subprocess for better path handling
-            import subprocess
-            try:
-                result = subprocess.run([
-                    openscad_exe,
-                    "-o",
-                    stl_path,
-                    scad_path
-                ], capture_output=True, text=True)
-                
-                if result.returncode != 0:
-                    print("OpenSCAD Error Output:")
-                    print(result.stderr)
-                    raise ValueError(f"OpenSCAD command failed with exit code {result.returncode}")
-                
-            except Exception as e:
-                print(f"Error running OpenSCAD: {str(e)}")
-                print(f"Command attempted: {openscad_exe} -o {stl_path} {scad_path}")
-                raise ValueError("Failed to run OpenSCAD command. Please ensure OpenSCAD is properly installed.")
+            # Run OpenSCAD as an async subprocess so concurrent renders overlap
+            async with self._scad_sem:
+                try:
+                    proc = await asyncio.create_subprocess_exec(
+                        openscad_exe,
+                        "-o",
+                        tmp_stl_path,
+                        scad_path,
+                        stdout=asyncio.subprocess.PIPE,
+                        stderr=asyncio.subprocess.PIPE
+                    )
+                    stdout, stderr = await proc.communicate()
+                    
+                    if proc.returncode != 0:
+                        print("OpenSCAD Error Output:")
+                        print(stderr.decode('utf-8', errors='replace'))
+                        raise ValueError(f"OpenSCAD command failed with exit code {proc.returncode}")
+                    
+                    os.replace(tmp_stl_path, stl_path)
+                    
+                except Exception as e:
+                    print(f"Error running OpenSCAD: {str(e)}")
+                    print(f"Command attempted: {openscad_exe} -o {tmp_stl_path} {scad_path}")
+                    # Drop any partial render
+                    if os.path.exists(tmp_stl_path):
+                        os.remove(tmp_stl_path)
+                    raise ValueError("Failed to run OpenSCAD command. Please ensure OpenSCAD is properly installed.")
+                finally:
+                    # The .scad file is only an input to the render
+                    os.remove(scad_path)
             
-            # Save dimensions as BREP
-            with open(brep_path, 'w') as f:
-                f.write(str(model_dict['dimensions']))
+            # Save dimensions as BREP, serialized as JSON
+            await asyncio.to_thread(self._write_file, brep_path, _json_dumps(model_dict['dimensions']))
             
             return stl_path, brep_path
             
@@ -19,16 +19,22 @@ class ModelResponse(BaseModel):
     stl_path: str
     brep_path: str
 
+@app.on_event("startup")
+async def startup():
+    # Create the GCP storage client and builder once and share them across requests
+    app.state.storage_client = storage.Client()
+    app.state.bucket = app.state.storage_client.bucket(os.getenv("GCP_BUCKET_NAME"))
+    app.state.builder = ClaudeMCPBuilder()
+
+@app.on_event("shutdown")
+async def shutdown():
+    # Close the builder's pooled API connections before the event loop stops
+    await app.state.builder.aclose()
+
 @app.post("/generate-3d-model", response_model=ModelResponse)
 async def generate_3d_model(image_paths: ImagePaths):
     try:
-        # Initialize GCP storage client
-        storage_client = storage.Client()
-        bucket_name = os.getenv("GCP_BUCKET_NAME")
-        bucket = storage_client.bucket(bucket_name)
-
-        # Initialize ClaudeMCPBuilder
-        builder = ClaudeMCPBuilder()
+        builder = app.state.builder
         
         # Generate 3D model
         stl_path, brep_path = await builder.generate_model(
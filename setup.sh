@@ -1,6 +1,7 @@
 #!/bin/bash
 
-# Install OpenSCAD
+# Install OpenSCAD (2021.01 or newer is required for --export-format binstl;
+# older distributions may package an earlier release)
 if [[ "$OSTYPE" == "linux-gnu"* ]]; then
     sudo apt-get update
     sudo apt-get install -y openscad
@@ -11,5 +12,9 @@ elif [[ "$OSTYPE" == "msys"* || "$OSTYPE" == "win32" ]]; then
     echo "Make sure it's added to your system PATH"
 fi
 
+if command -v openscad >/dev/null 2>&1; then
+    echo "Found $(openscad --version 2>&1); 2021.01 or newer is required"
+fi
+
 # Install Python dependencies
 pip install -r requirements.txt 
\ No newline at end of file